@@ -1,20 +1,23 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+import logging
 import os
+import re
 
 
 ENV_PATH = Path.home() / ".ha_env"
 
+_ENV_RE = re.compile(r"^export (\w+)=(.*)$", re.MULTILINE)
+
 
 def load_env_file(path: Path = ENV_PATH) -> None:
     if not path.exists():
         return
-    for line in path.read_text().splitlines():
-        if line.startswith("export "):
-            key, value = line[len("export "):].split("=", 1)
-            os.environ.setdefault(key, value.strip('"'))
+    for m in _ENV_RE.finditer(path.read_text()):
+        os.environ.setdefault(m.group(1), m.group(2).strip('"'))
 
 
 @dataclass(frozen=True)
@@ -28,7 +31,16 @@ class Settings:
     llm_api_key: str
 
 
+def log_level() -> int:
+    # Unknown names fall back to INFO rather than failing basicConfig.
+    level = getattr(logging, os.environ.get("LOG_LEVEL", "INFO").strip().upper(), None)
+    return level if isinstance(level, int) else logging.INFO
+
+
+@lru_cache(maxsize=1)
 def load_settings() -> Settings:
+    # Settings is frozen, so every caller can share one instance. Call
+    # load_settings.cache_clear() to pick up environment changes.
     load_env_file()
     ha_url = os.environ.get("HA_URL", "http://192.168.1.203:8123")
     ha_token = os.environ.get("HA_TOKEN")
@@ -1,11 +1,29 @@
 from __future__ import annotations
 
+import concurrent.futures
+from functools import lru_cache
 from typing import Any, Dict
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from assistant_env import Settings
 
+HA_TIMEOUT = (2, 10)  # (connect, read) seconds
+
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Fire-and-forget calls (chimes) run here so callers are not held up waiting
+# for HA to acknowledge each request.
+_HA_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+
+def hass_session() -> requests.Session:
+    """Shared keep-alive session so repeated calls reuse pooled connections."""
+    return _SESSION
+
 
 def _require_token(settings: Settings) -> str:
     if not settings.ha_token:
@@ -13,13 +31,18 @@ def _require_token(settings: Settings) -> str:
     return settings.ha_token
 
 
+@lru_cache(maxsize=4)
+def auth_headers(token: str) -> Dict[str, str]:
+    # Shared across calls; requests copies headers, so callers must not mutate it.
+    return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+
 def call_service(settings: Settings, domain: str, service: str, data: Dict[str, Any]) -> Any:
-    token = _require_token(settings)
-    response = requests.post(
+    response = _SESSION.post(
         f"{settings.ha_url}/api/services/{domain}/{service}",
-        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        headers=auth_headers(_require_token(settings)),
         json=data,
-        timeout=10,
+        timeout=HA_TIMEOUT,
     )
     response.raise_for_status()
     return response.json()
@@ -45,3 +68,38 @@ def set_volume(settings: Settings, entity_id: str, level: float) -> None:
         "volume_set",
         {"entity_id": entity_id, "volume_level": level},
     )
+
+
+def run_script(settings: Settings, script_id: str, variables: Dict[str, Any]) -> Any:
+    # script.turn_on returns once the script has started instead of waiting
+    # for it to finish.
+    return call_service(
+        settings,
+        "script",
+        "turn_on",
+        {"entity_id": script_id, "variables": variables},
+    )
+
+
+def play_sound(settings: Settings, entity_id: str, url: str, volume: float) -> None:
+    """Set the volume and play a clip in one HA request (see README for the script)."""
+    run_script(
+        settings,
+        "script.assistant_play_sound",
+        {"entity_id": entity_id, "url": url, "volume": volume},
+    )
+
+
+def _report_ha_error(future: concurrent.futures.Future) -> None:
+    exc = future.exception()
+    if exc is not None:
+        print(f"HA call failed: {exc}")
+
+
+def play_sound_async(
+    settings: Settings, entity_id: str, url: str, volume: float
+) -> concurrent.futures.Future:
+    """play_sound in the background; failures are printed, not raised."""
+    future = _HA_POOL.submit(play_sound, settings, entity_id, url, volume)
+    future.add_done_callback(_report_ha_error)
+    return future
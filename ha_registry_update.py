@@ -2,87 +2,133 @@
 from __future__ import annotations
 
 import json
-import re
 import sys
 import time
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List
 
-import requests
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json works the same
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # optional; falls back to parsing the whole response
+    ijson = None
 
 from assistant_env import load_settings
+from ha_client import HA_TIMEOUT, auth_headers, hass_session
+
+
+_NORM_KEEP = "abcdefghijklmnopqrstuvwxyz0123456789"
+
+
+class _NormTable(dict):
+    # Anything that is not a lowercase ASCII letter or digit becomes a space.
+    def __missing__(self, key: int) -> str:
+        return " "
+
+
+# Every ASCII code point is listed explicitly so only non-ASCII input hits
+# __missing__; the common case stays inside str.translate.
+_NORM_TABLE = _NormTable(
+    {i: (i if chr(i) in _NORM_KEEP else " ") for i in range(128)}
+)
 
 
 def norm(s: str) -> str:
-    s = s.lower().strip()
-    s = re.sub(r"[_\-]+", " ", s)
-    s = re.sub(r"[^a-z0-9 ]+", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    return " ".join(s.lower().translate(_NORM_TABLE).split())
 
 
-def ha_get(ha_url: str, ha_token: str, path: str, timeout: int = 10) -> Any:
+def ha_get(ha_url: str, ha_token: str, path: str, timeout: Any = HA_TIMEOUT) -> Any:
     if not ha_token:
         raise RuntimeError("HA_TOKEN env var not set")
-    response = requests.get(
+    response = hass_session().get(
         f"{ha_url}{path}",
-        headers={"Authorization": f"Bearer {ha_token}"},
+        headers=auth_headers(ha_token),
         timeout=timeout,
     )
     response.raise_for_status()
     return response.json()
 
 
+def ha_iter(ha_url: str, ha_token: str, path: str, timeout: Any = HA_TIMEOUT) -> Iterator[Any]:
+    """Yield the items of a JSON array endpoint, parsing the body as it streams in."""
+    if ijson is None:
+        yield from ha_get(ha_url, ha_token, path, timeout=timeout)
+        return
+    if not ha_token:
+        raise RuntimeError("HA_TOKEN env var not set")
+    with hass_session().get(
+        f"{ha_url}{path}",
+        headers=auth_headers(ha_token),
+        timeout=timeout,
+        stream=True,
+    ) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True  # undo gzip before ijson sees it
+        yield from ijson.items(response.raw, "item", use_float=True)
+
+
 def main() -> int:
     settings = load_settings()
     out_path = settings.registry_path
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    states = ha_get(settings.ha_url, settings.ha_token, "/api/states")
+    states = ha_iter(settings.ha_url, settings.ha_token, "/api/states")
 
     entities: List[Dict[str, Any]] = []
+    by_friendly: Dict[str, List[str]] = {}
+    by_entity: Dict[str, str] = {}
+    lights = switches = 0
     for st in states:
         entity_id = st.get("entity_id", "")
-        if not (entity_id.startswith("light.") or entity_id.startswith("switch.")):
+        if not entity_id.startswith(("light.", "switch.")):
             continue
+        if entity_id[0] == "l":
+            domain = "light"
+            lights += 1
+        else:
+            domain = "switch"
+            switches += 1
 
         attrs = st.get("attributes", {}) or {}
         friendly = attrs.get("friendly_name") or entity_id
 
+        color_modes = attrs.get("supported_color_modes")
+        if "brightness" in attrs:
+            if not color_modes:
+                color_modes = ["brightness"]
+            elif "brightness" not in color_modes:
+                color_modes.append("brightness")
+        if color_modes and "color_temp" in color_modes:
+            color_modes.remove("color_temp")
+            color_modes.append("color_temp_kelvin")
+
+        friendly_norm = norm(str(friendly))
+        entity_norm = norm(entity_id)
+        by_entity[entity_norm] = entity_id
+        by_friendly.setdefault(friendly_norm, []).append(entity_id)
+
         entities.append(
             {
                 "entity_id": entity_id,
-                "domain": entity_id.split(".", 1)[0],
+                "domain": domain,
                 "friendly_name": friendly,
-                "friendly_norm": norm(str(friendly)),
-                "entity_norm": norm(entity_id),
+                "friendly_norm": friendly_norm,
+                "entity_norm": entity_norm,
                 "device_class": attrs.get("device_class"),
-                "supported_color_modes": attrs.get("supported_color_modes"),
+                "supported_color_modes": color_modes,
             }
         )
-        if "brightness" in attrs:
-            supported = entities[-1]["supported_color_modes"]
-            if not supported:
-                entities[-1]["supported_color_modes"] = ["brightness"]
-            elif "brightness" not in supported:
-                supported.append("brightness")
-        if "color_temp" in attrs.get("supported_color_modes", []):
-            scm = entities[-1]["supported_color_modes"]
-            scm.remove("color_temp")
-            scm.append("color_temp_kelvin")
-
-    by_friendly: Dict[str, List[str]] = {}
-    by_entity: Dict[str, str] = {}
-    for e in entities:
-        by_entity[e["entity_norm"]] = e["entity_id"]
-        by_friendly.setdefault(e["friendly_norm"], []).append(e["entity_id"])
 
     payload = {
         "generated_at": time.time(),
         "ha_url": settings.ha_url,
         "counts": {
-            "lights": sum(1 for e in entities if e["domain"] == "light"),
-            "switches": sum(1 for e in entities if e["domain"] == "switch"),
+            "lights": lights,
+            "switches": switches,
             "total": len(entities),
         },
         "entities": entities,
@@ -93,7 +139,10 @@ def main() -> int:
     }
 
     tmp = out_path.with_suffix(".tmp")
-    tmp.write_text(json.dumps(payload, indent=2, sort_keys=True))
+    if orjson is not None:
+        tmp.write_bytes(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2))
+    else:
+        tmp.write_text(json.dumps(payload, indent=2, sort_keys=True))
     tmp.replace(out_path)
     return 0
 
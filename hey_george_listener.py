@@ -1,20 +1,18 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import logging
 import multiprocessing as mp
-import os
-import tempfile
 import time
+from multiprocessing.connection import Connection
 
 import numpy as np
 import sounddevice as sd
-import soundfile as sf
-import requests
 
 from openwakeword.model import Model
 
-from assistant_env import load_settings
-from ha_client import play_on_sonos, set_volume
+from assistant_env import Settings, load_settings, log_level
+from ha_client import hass_session, play_sound_async
 
 # --- CONFIG ---
 SAMPLE_RATE = 16000
@@ -24,6 +22,7 @@ REARM_THRESHOLD = 0.35
 RECORD_SECONDS = 4.0
 COOLDOWN_SECONDS = 1.0
 REARM_SILENCE_FRAMES = 5
+MAX_BATCH = 8  # most queued commands the router sends in one LLM request
 
 # Choose a built-in wake word model to get working immediately.
 # Later you will replace this with a custom "hey_george" model.
@@ -36,7 +35,7 @@ DEVICE_INDEX = 1      # <-- PulseAudio device
 sd.default.device = (DEVICE_INDEX, None)
 
 
-def record_wav(seconds: float) -> str:
+def record_audio(seconds: float) -> np.ndarray:
     audio = sd.rec(
         int(seconds * SAMPLE_RATE),
         samplerate=SAMPLE_RATE,
@@ -45,46 +44,74 @@ def record_wav(seconds: float) -> str:
         # device=INPUT_DEVICE,
     )
     sd.wait()
-    audio = np.squeeze(audio)
-    temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-    sf.write(temp_file.name, audio, SAMPLE_RATE)
-    return temp_file.name
-
-
-def transcribe(stt_url: str, wav_path: str) -> str:
-    with open(wav_path, "rb") as audio:
-        response = requests.post(
-            stt_url,
-            files={"audio": ("audio.wav", audio, "audio/wav")},
-            timeout=120,
-        )
+    return np.squeeze(audio)
+
+
+def play_ready_chime(settings: Settings) -> None:
+    # Returns at once so recording is not held up waiting on HA.
+    play_sound_async(
+        settings,
+        "media_player.living_room",
+        "http://192.168.1.203:8123/local/ready_for_capture.wav",
+        0.1,
+    )
+
+
+def transcribe(stt_url: str, audio: np.ndarray) -> str:
+    # Ship the raw float32 samples; the server hands them to Whisper as an
+    # array, so neither side encodes or decodes a WAV file.
+    response = hass_session().post(
+        stt_url,
+        data=audio.astype(np.float32, copy=False).tobytes(),
+        headers={
+            "Content-Type": "application/octet-stream",
+            "X-Sample-Rate": str(SAMPLE_RATE),
+            "X-Dtype": "float32",
+        },
+        timeout=120,
+    )
     response.raise_for_status()
     return response.json().get("text", "").strip()
 
 
-def router_process(text_queue: mp.Queue[str]) -> None:
-    settings = load_settings()
-    from voice_route import handle_text
+def router_process(text_conn: Connection) -> None:
+    settings = load_settings()  # also reads LOG_LEVEL from ~/.ha_env
+    logging.basicConfig(level=log_level())
+    from voice_route import handle_text_batch, warm_up
 
+    warm_up(settings)
     while True:
-        text = text_queue.get()
-        if text is None:
+        text = text_conn.recv_bytes().decode("utf-8")
+        if not text:
+            break
+        # Commands that queued up while the router was busy share one LLM call.
+        texts = [text]
+        while len(texts) < MAX_BATCH and text_conn.poll():
+            text = text_conn.recv_bytes().decode("utf-8")
+            if not text:
+                break
+            texts.append(text)
+        handle_text_batch(settings, texts)
+        if not text:
             break
-        handle_text(settings, text)
 
 
-def start_router(ctx: mp.context.BaseContext, queue: mp.Queue[str] | None = None) -> tuple[mp.Process, mp.Queue[str]]:
-    if queue is None:
-        queue = ctx.Queue()
-    proc = ctx.Process(target=router_process, args=(queue,), daemon=True)
+def start_router(
+    ctx: mp.context.BaseContext, pipe: tuple[Connection, Connection] | None = None
+) -> tuple[mp.Process, tuple[Connection, Connection]]:
+    # A one-way pipe of UTF-8 bytes: no pickling or feeder thread as with
+    # mp.Queue. Both ends are kept so a restarted router reuses the pipe.
+    if pipe is None:
+        pipe = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=router_process, args=(pipe[0],), daemon=True)
     proc.start()
-    return proc, queue
+    return proc, pipe
 
 
 def main() -> None:
     settings = load_settings()
     ctx = mp.get_context("spawn")
-    router_proc, router_queue = start_router(ctx)
+    router_proc, router_pipe = start_router(ctx)
     print(
         f"Listening for wake word: {WAKEWORD_NAME} (temporary). Threshold={TRIGGER_THRESHOLD}"
     )
@@ -100,45 +127,34 @@ def main() -> None:
     stream.start()
     armed = True
     silence_frames = 0
+    wakeword_key = WAKEWORD_NAME
 
     try:
         while True:
             if not router_proc.is_alive():
                 print("Router process died; restarting.")
-                router_proc, router_queue = start_router(ctx, router_queue)
+                router_proc, router_pipe = start_router(ctx, router_pipe)
 
             data, _ = stream.read(CHUNK)
-            pcm16 = np.squeeze(data)
+            pcm16 = data[:, 0]  # mono column view, no reshape/copy
 
-            preds = oww.predict(pcm16)
-            score = float(preds.get(WAKEWORD_NAME, 0.0))
+            score = oww.predict(pcm16).get(wakeword_key, 0.0)
 
             if armed and score >= TRIGGER_THRESHOLD:
                 print("Wake word detected. Recording command...")
 
-                set_volume(settings, "media_player.living_room", 0.1)
-                play_on_sonos(
-                    settings,
-                    "media_player.living_room",
-                    "http://192.168.1.203:8123/local/ready_for_capture.wav",
-                )
+                play_ready_chime(settings)
 
                 time.sleep(0.15)  # tiny pause to avoid clipping first syllable
 
-                wav = record_wav(RECORD_SECONDS)
-                try:
-                    t0 = time.time()
-                    text = transcribe(settings.stt_url, wav)
-                    dt = time.time() - t0
-                    print(f"Transcription took {dt:.2f} seconds.")
-                    print("Heard:", text)
-                    if text:
-                        router_queue.put(text)
-                finally:
-                    try:
-                        os.remove(wav)
-                    except OSError:
-                        pass
+                audio = record_audio(RECORD_SECONDS)
+                t0 = time.time()
+                text = transcribe(settings.stt_url, audio)
+                dt = time.time() - t0
+                print(f"Transcription took {dt:.2f} seconds.")
+                print("Heard:", text)
+                if text:
+                    router_pipe[1].send_bytes(text.encode("utf-8"))
 
                 time.sleep(COOLDOWN_SECONDS)
                 armed = False
@@ -1,16 +1,42 @@
-rom fastapi import FastAPI, UploadFile, File, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from faster_whisper import WhisperModel
-import tempfile, shutil, time, os
+import numpy as np
+import soundfile as sf
+import tempfile, shutil, time, os, io
+import hashlib
 import inspect
-from typing import List, Optional
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 app = FastAPI()
 
+# Multipart uploads are spooled here. The write and the transcription run
+# without an await in between, so requests never interleave on this file.
+_STT_PATH = os.path.join(tempfile.gettempdir(), f"stt_{os.getpid()}.wav")
+
 # Default: fast
 model_fast = WhisperModel("small", device="cuda", compute_type="int8_float16")
 
-# Fallback: more robust
-model_robust = WhisperModel("medium", device="cuda", compute_type="float16")
+# Fallback: more robust. Loaded on first use so it doesn't sit in VRAM on
+# devices where the fast model is nearly always good enough.
+_model_robust = None
+
+def get_robust() -> WhisperModel:
+    global _model_robust
+    if _model_robust is None:
+        _model_robust = WhisperModel("medium", device="cuda", compute_type="float16")
+    return _model_robust
+
+@app.on_event("startup")
+def warm_up() -> None:
+    # The first decode pays for CUDA context/kernel setup; do it before the
+    # first real utterance instead of during it. VAD is off so the decoder
+    # actually runs on the silent clip.
+    segments, _ = model_fast.transcribe(
+        np.zeros(16000, dtype=np.float32), language="en", beam_size=1, vad_filter=False
+    )
+    list(segments)
 
 VAD_PARAMS = {
     "min_silence_duration_ms": 180,
@@ -29,6 +55,18 @@ TRANSCRIBE_KW = dict(
 
 LANG_PROB_FALLBACK = 0.60
 MIN_CHARS_FALLBACK = 3
+# Less speech than this (after VAD) is a click or noise; the medium model
+# can't recover words that aren't there, so don't pay for a second pass.
+MIN_SPEECH_FALLBACK = 0.4
+# Language detection runs before decoding. If the fast model is this unsure
+# about a clip with real speech in it, skip its decode and go straight to
+# the robust model.
+LANG_PROB_ABANDON = 0.30
+MIN_SPEECH_ABANDON = 1.0
+
+# Replayed clips (retries, test fixtures) skip the GPU entirely.
+RESULT_CACHE_SIZE = 32
+_RESULT_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
 
 # ---- NEW: global bias words (optional default) ----
 DEFAULT_BIAS_WORDS = [
@@ -53,6 +91,22 @@ def build_initial_prompt(bias_words: List[str]) -> str:
             f"Look for:\n* home assistant actions (e.g., turn on, turn off, brightness, etc.), followed by \n* a home device name/noun, including {words}."
     )
 
+@lru_cache(maxsize=32)
+def cached_initial_prompt(bias_words: Tuple[str, ...]) -> str:
+    """
+    The prompt only depends on the bias words, which are nearly always the
+    defaults, so build it once per distinct word list.
+    """
+    return build_initial_prompt(list(bias_words))
+
+@lru_cache(maxsize=4)
+def _supports_hotwords(model_cls: type) -> bool:
+    # inspect.signature is slow; the answer only depends on the installed class.
+    try:
+        return "hotwords" in inspect.signature(model_cls.transcribe).parameters
+    except Exception:
+        return False
+
 def add_hotwords_if_supported(model: WhisperModel, kw: dict, bias_words: List[str]) -> dict:
     """
     Some faster-whisper versions support hotwords in WhisperModel.transcribe.
@@ -61,27 +115,14 @@ def add_hotwords_if_supported(model: WhisperModel, kw: dict, bias_words: List[st
     if not bias_words:
         return kw
 
-    try:
-        sig = inspect.signature(model.transcribe)
-        if "hotwords" in sig.parameters:
-            # faster-whisper typically expects a string like "word1 word2"
-            kw = dict(kw)
-            kw["hotwords"] = " ".join(bias_words)
-    except Exception:
-        pass
+    if _supports_hotwords(type(model)):
+        # faster-whisper typically expects a string like "word1 word2"
+        kw = dict(kw)
+        kw["hotwords"] = " ".join(bias_words)
 
     return kw
 
-@app.post("/stt")
-async def stt(
-    audio: UploadFile = File(...),
-    bias: Optional[List[str]] = Query(default=None, description="Words/phrases to bias toward"),
-):
-    # Save upload to temp file
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        shutil.copyfileobj(audio.file, tmp)
-        tmp_path = tmp.name
-
+def merge_bias_words(bias: Optional[List[str]]) -> List[str]:
     # combine per-request bias with defaults
     bias_words = []
     if DEFAULT_BIAS_WORDS:
@@ -92,31 +133,86 @@ async def stt(
 
     # de-dupe while preserving order
     seen = set()
-    bias_words = [w for w in bias_words if not (w.lower() in seen or seen.add(w.lower()))]
+    return [w for w in bias_words if not (w.lower() in seen or seen.add(w.lower()))]
 
-    try:
-        info, text, used = transcribe_with_fallback(tmp_path, bias_words=bias_words)
-        return {
-            "text": text,
-            "language": info.language,
-            "language_probability": getattr(info, "language_probability", None),
-            "duration": info.duration,
-            "model": used,
-            "bias_words": bias_words,
-        }
-    finally:
-        try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
-
-def transcribe_once(model, path, bias_words: List[str]):
+def decode_wav(data: bytes):
+    """
+    Decode WAV bytes in memory. 16 kHz audio becomes a float32 array Whisper
+    can use as-is; other rates are left to faster-whisper's resampling decoder.
+    """
+    buf = io.BytesIO(data)
+    # Check the header first so other rates aren't decoded twice.
+    samplerate = sf.info(buf).samplerate
+    buf.seek(0)
+    if samplerate != 16000:
+        return buf
+    audio, _ = sf.read(buf, dtype="float32")
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    return audio
+
+def stt_response(source, bias: Optional[List[str]]) -> dict:
+    bias_words = merge_bias_words(bias)
+    info, text, used = transcribe_with_fallback(source, bias_words=bias_words)
+    return {
+        "text": text,
+        "language": info.language,
+        "language_probability": getattr(info, "language_probability", None),
+        "duration": info.duration,
+        "model": used,
+        "bias_words": bias_words,
+    }
+
+@app.post("/stt")
+async def stt(
+    request: Request,
+    bias: Optional[List[str]] = Query(default=None, description="Words/phrases to bias toward"),
+):
+    # Accept a multipart "audio" upload, raw float32 PCM, or a raw audio/wav body.
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("audio")
+        if not hasattr(upload, "file"):
+            raise HTTPException(status_code=422, detail="multipart body needs an 'audio' file field")
+        with open(_STT_PATH, "wb") as tmp:
+            shutil.copyfileobj(upload.file, tmp)
+        source = _STT_PATH
+    elif request.headers.get("content-type", "").startswith("application/octet-stream"):
+        # Raw PCM samples; Whisper takes a 16 kHz float32 array directly.
+        if request.headers.get("x-sample-rate", "16000") != "16000":
+            raise HTTPException(status_code=400, detail="raw audio must be sampled at 16000 Hz")
+        if request.headers.get("x-dtype", "float32") != "float32":
+            raise HTTPException(status_code=400, detail="raw audio must be float32")
+        body = await request.body()
+        if len(body) % 4:
+            raise HTTPException(status_code=400, detail="raw float32 body length must be a multiple of 4")
+        source = np.frombuffer(body, dtype=np.float32)
+    else:
+        source = decode_wav(await request.body())
+
+    return stt_response(source, bias)
+
+@app.post("/stt_raw")
+async def stt_raw(
+    request: Request,
+    bias: Optional[List[str]] = Query(default=None, description="Words/phrases to bias toward"),
+):
+    # WAV bytes as the request body, decoded in memory (no temp file).
+    return stt_response(decode_wav(await request.body()), bias)
+
+def speech_duration(info) -> float:
+    speech = getattr(info, "duration_after_vad", None)
+    if speech is None:
+        speech = info.duration or 0.0
+    return speech
+
+def transcribe_once(model, path, bias_words: List[str], abandon_below: Optional[float] = None):
     t0 = time.time()
 
     kw = dict(TRANSCRIBE_KW)
 
     # ---- NEW: initial_prompt ----
-    prompt = build_initial_prompt(bias_words)
+    prompt = cached_initial_prompt(tuple(bias_words))
     if prompt:
         print("Inition prompt: ", prompt)
         kw["initial_prompt"] = prompt
@@ -124,8 +220,20 @@ def transcribe_once(model, path, bias_words: List[str]):
     # ---- NEW: hotwords if supported ----
     kw = add_hotwords_if_supported(model, kw, bias_words)
 
+    if hasattr(path, "seek"):
+        # In-memory uploads are read once per pass (fast, then fallback).
+        path.seek(0)
     segments, info = model.transcribe(path, **kw)
-    text = " ".join(seg.text.strip() for seg in segments).strip()
+    # segments is lazy, so abandoning here skips the decode entirely.
+    lang_prob = getattr(info, "language_probability", 1.0)
+    if (
+        abandon_below is not None
+        and lang_prob < abandon_below
+        and speech_duration(info) > MIN_SPEECH_ABANDON
+    ):
+        text = None
+    else:
+        text = " ".join(seg.text.strip() for seg in segments).strip()
     dt = time.time() - t0
 
     duration = info.duration or 0.0
@@ -133,11 +241,43 @@ def transcribe_once(model, path, bias_words: List[str]):
 
     return info, text, dt, rtf
 
+def audio_fingerprint(source) -> bytes:
+    if isinstance(source, np.ndarray):
+        return hashlib.blake2b(memoryview(np.ascontiguousarray(source)), digest_size=8).digest()
+    if hasattr(source, "getbuffer"):
+        with source.getbuffer() as data:
+            return hashlib.blake2b(data, digest_size=8).digest()
+    with open(source, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=8).digest()
+
 def transcribe_with_fallback(path, bias_words: List[str]):
-    info, text, dt, rtf = transcribe_once(model_fast, path, bias_words=bias_words)
+    key = (audio_fingerprint(path), tuple(bias_words))
+    cached = _RESULT_CACHE.get(key)
+    if cached is not None:
+        _RESULT_CACHE.move_to_end(key)
+        print(f"[cache] text='{cached[1]}'")
+        return cached
+
+    result = _transcribe_with_fallback(path, bias_words)
+    _RESULT_CACHE[key] = result
+    if len(_RESULT_CACHE) > RESULT_CACHE_SIZE:
+        _RESULT_CACHE.popitem(last=False)
+    return result
+
+def _transcribe_with_fallback(path, bias_words: List[str]):
+    info, text, dt, rtf = transcribe_once(
+        model_fast, path, bias_words=bias_words, abandon_below=LANG_PROB_ABANDON
+    )
 
     lang_prob = getattr(info, "language_probability", 1.0)
-    need_fallback = (len(text) < MIN_CHARS_FALLBACK) or (lang_prob < LANG_PROB_FALLBACK)
+    if text is None:
+        need_fallback = True
+        branch = "abandoned"
+    else:
+        need_fallback = speech_duration(info) >= MIN_SPEECH_FALLBACK and (
+            (len(text) < MIN_CHARS_FALLBACK) or (lang_prob < LANG_PROB_FALLBACK)
+        )
+        branch = "fallback" if need_fallback else "accepted"
 
     print(
         f"[fast] "
@@ -146,11 +286,12 @@ def transcribe_with_fallback(path, bias_words: List[str]):
         f"RTF={rtf:.2f} "
         f"lang={info.language} "
         f"p={lang_prob:.2f} "
+        f"branch={branch} "
         f"text='{text}'"
     )
 
     if need_fallback:
-        info2, text2, dt2, rtf2 = transcribe_once(model_robust, path, bias_words=bias_words)
+        info2, text2, dt2, rtf2 = transcribe_once(get_robust(), path, bias_words=bias_words)
         lang_prob2 = getattr(info2, "language_probability", 1.0)
 
         print(
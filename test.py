@@ -1,12 +1,54 @@
+import os
+import resource
 import time
+
+try:
+    import psutil
+
+    phys_cores = psutil.cpu_count(logical=False) or os.cpu_count()
+except ImportError:
+    phys_cores = os.cpu_count()
+
+# OpenMP reads these when CTranslate2 loads, so set them before the import.
+# Spinning workers avoid wake-up latency between the short decode steps.
+os.environ.setdefault("OMP_WAIT_POLICY", "ACTIVE")
+os.environ.setdefault("OMP_NUM_THREADS", str(phys_cores))
+os.environ.setdefault("KMP_BLOCKTIME", "0")
+
 from faster_whisper import WhisperModel
 
 audio = "output.wav"  # pick a representative clip
+ggml_model = "ggml-base.en-q5_0.bin"  # whisper.cpp int5 model for comparison
+
 
-for ct in ["int8_float32", "int8"]:
-    model = WhisperModel("base.en", device="cpu", compute_type=ct)
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and only ever grows, so later rows include earlier ones
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+duration = None
+for ct in ["int8", "int8_float32", "auto"]:
+    model = WhisperModel("base.en", device="cpu", compute_type=ct, cpu_threads=phys_cores, num_workers=1)
     t0 = time.time()
-    segments, info = model.transcribe(audio, beam_size=1)  # beam_size=1 for speed test
+    segments, info = model.transcribe(
+        audio,
+        beam_size=1,  # beam_size=1 for speed test
+        language="en",  # skip language detection
+        vad_filter=True,
+        condition_on_previous_text=False,
+    )
     _ = list(segments)
     dt = time.time() - t0
-    print(ct, "seconds:", dt, "duration:", info.duration, "RTF:", dt / info.duration)
+    duration = info.duration
+    print(ct, "seconds:", dt, "duration:", duration, "RTF:", dt / duration, "peak RSS MB:", peak_rss_mb())
+
+try:
+    from pywhispercpp.model import Model
+except ImportError:
+    print("pywhispercpp not installed; skipping whisper.cpp run")
+else:
+    model = Model(ggml_model, n_threads=phys_cores)
+    t0 = time.time()
+    _ = model.transcribe(audio, language="en")
+    dt = time.time() - t0
+    print("whisper.cpp q5_0", "seconds:", dt, "duration:", duration, "RTF:", dt / duration, "peak RSS MB:", peak_rss_mb())
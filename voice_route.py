@@ -1,37 +1,107 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import concurrent.futures
+import heapq
 import json
+import logging
 import re
 import sys
+import textwrap
 import time
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterator, List, Tuple
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from assistant_env import load_settings
-from ha_client import call_service, play_on_sonos, set_volume
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json works the same
+    orjson = None
 
-ALLOWED_SERVICES = {"turn_on", "turn_off"}
+from assistant_env import load_settings, log_level
+from ha_client import auth_headers, call_service, hass_session, play_sound_async
+from ha_registry_update import norm
+
+logger = logging.getLogger(__name__)
 
+ALLOWED_SERVICES = {"turn_on", "turn_off"}
 
-def norm(s: str) -> str:
-    s = s.lower().strip()
-    s = re.sub(r"[_\-]+", " ", s)
-    s = re.sub(r"[^a-z0-9 ]+", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _json_body(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+# Service data the LLM may set, with the inclusive range each is clamped to.
+_PARAM_SPEC = {
+    "brightness_pct": (1, 100),
+    "color_temp_kelvin": (2300, 4000),
+}
+
+# Speaker/device settings exposed as switches that should never be offered
+# to the LLM.
+_HIDDEN_ENTITY_NAMES = (
+    "Child lock",
+    "Disable LED",
+    "Loudness",
+    "Crossfade",
+    "Surround",
+    "Night sound",
+    "Subwoofer",
+    "Speech enhancement",
+)
+_HIDDEN_ENTITY_RE = re.compile("|".join(map(re.escape, _HIDDEN_ENTITY_NAMES)))
+
+LLM_TIMEOUT = (5, 60)  # (connect, read) seconds
+LLM_MAX_CONCURRENCY = 4  # parallel requests when a batch has to be split up
+
+# Keep-alive connection to the LLM server, reused across utterances.
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=LLM_MAX_CONCURRENCY))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=LLM_MAX_CONCURRENCY))
+_LLM_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY)
+# Streamed replies are read to the end here, after the answer is returned.
+_DRAIN_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY)
+_DRAIN_MAX_LINES = 32
+
+# Streaming is tried first. A streamed request failing with one of these
+# statuses is retried plain; if the error names "stream" or the plain retry
+# works, the server is sent plain requests from then on.
+_STREAM_REJECTED_STATUSES = {400, 404, 405, 415, 422}
+_llm_streaming = True
 
 
 def load_registry(registry_path: str) -> Dict[str, Any]:
-    return json.loads(Path(registry_path).read_text())
+    reg = _json_loads(Path(registry_path).read_bytes())
+    reg["_friendly_index"] = {
+        e.get("friendly_norm"): e.get("entity_id") for e in reg.get("entities", [])
+    }
+    return reg
+
+
+@lru_cache(maxsize=4)
+def _load_registry_cached(registry_path: str, mtime_ns: int) -> Dict[str, Any]:
+    return load_registry(registry_path)
+
+
+def current_registry(settings) -> Dict[str, Any]:
+    """Parsed registry, re-read only when the file on disk changes."""
+    path = settings.registry_path
+    return _load_registry_cached(str(path), path.stat().st_mtime_ns)
 
 
 def ha_call(settings, domain: str, service: str, data: dict) -> None:
-    t0 = time.time()
+    t0 = time.perf_counter()
     call_service(settings, domain, service, data)
-    print(f"HA call time: {time.time() - t0} s")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("HA call time: %.3fs", time.perf_counter() - t0)
 
 
 def _entity_options(reg: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -42,19 +112,7 @@ def _entity_options(reg: Dict[str, Any]) -> List[Dict[str, Any]]:
     }
     for entity in reg.get("entities", []):
         friendly_name = entity.get("friendly_name", "")
-        if all(
-            x not in friendly_name
-            for x in [
-                "Child lock",
-                "Disable LED",
-                "Loudness",
-                "Crossfade",
-                "Surround",
-                "Night sound",
-                "Subwoofer",
-                "Speech enhancement",
-            ]
-        ):
+        if _HIDDEN_ENTITY_RE.search(friendly_name) is None:
             supported_modes = entity.get("supported_color_modes") or []
             extra_params = [
                 mode_to_param[m] for m in supported_modes if m in mode_to_param
@@ -68,10 +126,72 @@ def _entity_options(reg: Dict[str, Any]) -> List[Dict[str, Any]]:
     return out
 
 
-def _build_prompt(user_text: str, reg: Dict[str, Any]) -> str:
+# Registries with more options than this only send the entities that best
+# match the utterance; fewer prompt tokens means a faster LLM prefill.
+PROMPT_MAX_ENTITIES = 12
+
+# Stand in for user_text / entity_options in the serialized prompt;
+# ensure_ascii turns them into these escaped (and otherwise impossible) JSON
+# strings.
+_USER_TEXT_SENTINEL = "\x00USER\x00"
+_USER_TEXT_PLACEHOLDER = '"\\u0000USER\\u0000"'
+_ENTITIES_SENTINEL = "\x00ENTITIES\x00"
+_ENTITIES_PLACEHOLDER = '"\\u0000ENTITIES\\u0000"'
+# entity_options items sit two levels deep in the indent=2 prompt.
+_ENTITY_INDENT = "    "
+
+
+def _trigrams(s: str) -> frozenset:
+    s = f" {s} "
+    return frozenset(s[i : i + 3] for i in range(len(s) - 2))
+
+
+def _prompt_entities(reg: Dict[str, Any]) -> List[Tuple[Dict[str, Any], str, frozenset, str]]:
+    # (option, friendly_norm, trigrams, serialized option) per entity,
+    # computed once per registry.
+    candidates = reg.get("_prompt_entities")
+    if candidates is None:
+        candidates = []
+        for option in _entity_options(reg):
+            friendly_norm = norm(option["friendly_name"])
+            fragment = textwrap.indent(json.dumps(option, ensure_ascii=True, indent=2), _ENTITY_INDENT)
+            candidates.append((option, friendly_norm, _trigrams(friendly_norm), fragment))
+        reg["_prompt_entities"] = candidates
+    return candidates
+
+
+def _ranked_entities(user_text: str, reg: Dict[str, Any]) -> List[int]:
+    """
+    Indices into _prompt_entities(reg), best first: entities named in the
+    utterance, topped up to PROMPT_MAX_ENTITIES with the closest trigram
+    matches (STT often mangles names).
+    """
+    candidates = _prompt_entities(reg)
+    text_norm = norm(user_text)
+    text_grams = _trigrams(text_norm)
+
+    def score(i: int) -> float:
+        grams = candidates[i][2]
+        return len(grams & text_grams) / len(grams) if grams else 0.0
+
+    exact = [i for i, c in enumerate(candidates) if c[1] and c[1] in text_norm]
+    exact_set = set(exact)
+    fuzzy = heapq.nlargest(
+        max(PROMPT_MAX_ENTITIES - len(exact), 0),
+        (i for i in range(len(candidates)) if i not in exact_set),
+        key=score,
+    )
+    return exact + fuzzy
+
+
+def _select_entities(user_text: str, reg: Dict[str, Any]) -> List[Tuple[Dict[str, Any], str, frozenset, str]]:
+    candidates = _prompt_entities(reg)
+    return [candidates[i] for i in sorted(_ranked_entities(user_text, reg))]
+
+
+def _prompt_dict(user_text: str, entities: Any) -> Dict[str, Any]:
     actions = ["turn_on", "turn_off"]
-    entities = _entity_options(reg)
-    prompt = {
+    return {
         "task": "Select the best Home Assistant action and entity from the options and return JSON only. This is the "
         "transcription of a verbal command and the STT algorithm may misunderstand words, so be mindful of words "
         "that sound similar. Still, if there's no obvious match, return empty text instead of guessing. "
@@ -85,18 +205,176 @@ def _build_prompt(user_text: str, reg: Dict[str, Any]) -> str:
             "data": "object; optional. Only include keys from selected entity_options.extra_parameters. THERE MAY BE MULTIPLE.",
         },
     }
+
+
+# The constant parts of the prompt, with slots for the entity list and text.
+_PROMPT_SKELETON = json.dumps(
+    _prompt_dict(_USER_TEXT_SENTINEL, _ENTITIES_SENTINEL), ensure_ascii=True, indent=2
+)
+
+
+def _entities_json(candidates: List[Tuple[Dict[str, Any], str, frozenset, str]]) -> str:
+    # Matches json.dumps(indent=2) for the list at its depth in the prompt.
+    if not candidates:
+        return "[]"
+    return "[\n" + ",\n".join(c[3] for c in candidates) + "\n  ]"
+
+
+def _prompt_template(reg: Dict[str, Any]) -> str:
+    # With every entity included, everything but user_text is fixed for a
+    # given registry, so assemble it once and keep it on the (cached) dict.
+    template = reg.get("_prompt_template")
+    if template is None:
+        template = _PROMPT_SKELETON.replace(
+            _ENTITIES_PLACEHOLDER, _entities_json(_prompt_entities(reg)), 1
+        )
+        reg["_prompt_template"] = template
+    return template
+
+
+def _build_prompt_batch(user_texts: List[str], reg: Dict[str, Any]) -> str:
+    candidates = _prompt_entities(reg)
+    if len(candidates) > PROMPT_MAX_ENTITIES:
+        # The whole batch shares the single-command entity budget (the LLM
+        # context is small): take each command's best matches in turn.
+        ranked = [_ranked_entities(text, reg) for text in user_texts]
+        chosen: set = set()
+        for rank in range(PROMPT_MAX_ENTITIES):
+            for indices in ranked:
+                if rank < len(indices) and len(chosen) < PROMPT_MAX_ENTITIES:
+                    chosen.add(indices[rank])
+        candidates = [candidates[i] for i in sorted(chosen)]
+    prompt = _prompt_dict(user_texts, [c[0] for c in candidates])
+    prompt["task"] += (
+        ". user_text is a list of separate commands: return a JSON array with one "
+        "output_schema object per command, in the same order"
+    )
+    prompt["output_schema"] = [prompt["output_schema"]]
     return json.dumps(prompt, ensure_ascii=True, indent=2)
 
 
-def _llm_request(llm_url: str, llm_model: str, llm_api_key: str, prompt: str) -> str:
+def _build_prompt(user_text: str, reg: Dict[str, Any]) -> str:
+    user_json = json.dumps(user_text, ensure_ascii=True)
+    if len(_prompt_entities(reg)) <= PROMPT_MAX_ENTITIES:
+        template = _prompt_template(reg)
+    else:
+        template = _PROMPT_SKELETON.replace(
+            _ENTITIES_PLACEHOLDER, _entities_json(_select_entities(user_text, reg)), 1
+        )
+    return template.replace(_USER_TEXT_PLACEHOLDER, user_json, 1)
+
+
+class _JsonObjectScanner:
+    """
+    Collects streamed text and notices when the first top-level JSON value
+    opened by `opener` ("{" for an object, "[" for an array) closes.
+    """
+
+    def __init__(self, opener: str = "{") -> None:
+        self._open = opener
+        self._close = "}" if opener == "{" else "]"
+        self._parts: List[str] = []
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self.complete = False
+
+    def feed(self, text: str) -> bool:
+        for i, c in enumerate(text):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = self._started
+            elif c == self._open:
+                self._started = True
+                self._depth += 1
+            elif c == self._close and self._started:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(text[: i + 1])
+                    self.complete = True
+                    return True
+        self._parts.append(text)
+        return False
+
+    def text(self) -> str:
+        content = "".join(self._parts)
+        if self.complete:
+            # Drop any preamble (e.g. a ```json fence) before the value.
+            content = content[content.index(self._open):]
+        return content.strip()
+
+
+def _llm_stream_content(
+    llm_url: str, headers: Dict[str, str], payload: Dict[str, Any], opener: str = "{"
+) -> str | None:
+    """
+    Stream the completion and return as soon as the reply's JSON value is
+    complete. Returns None if the request should be retried unstreamed.
+    """
+    global _llm_streaming
+    response = _SESSION.post(
+        llm_url, headers=headers, data=_json_body({**payload, "stream": True}), stream=True, timeout=LLM_TIMEOUT
+    )
+    try:
+        if response.status_code in _STREAM_REJECTED_STATUSES:
+            if b"stream" in response.content:
+                _llm_streaming = False
+            return None
+        response.raise_for_status()
+        if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+            # The server ignored "stream" and sent a whole completion.
+            return _message_content(response.content)
+        scanner = _JsonObjectScanner(opener)
+        lines = response.iter_lines()
+        for line in lines:
+            if not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                break
+            choices = _json_loads(data).get("choices") or []
+            if not choices:
+                continue
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta and scanner.feed(delta):
+                break
+        _DRAIN_POOL.submit(_drain_stream, response, lines)
+        response = None
+    finally:
+        if response is not None:
+            response.close()
+    return scanner.text()
+
+
+def _drain_stream(response: requests.Response, lines: Iterator[bytes]) -> None:
+    # Closing a half-read response drops its connection; reading the tail
+    # (usually just the finish_reason chunk and [DONE]) returns it to the
+    # pool instead. A reply that keeps going is cut off.
+    try:
+        for n, _ in enumerate(lines):
+            if n >= _DRAIN_MAX_LINES:
+                break
+    except requests.exceptions.RequestException:
+        pass
+    finally:
+        response.close()
+
+
+def _llm_request(llm_url: str, llm_model: str, llm_api_key: str, prompt: str, opener: str = "{") -> str:
     # 1. Check prompt
-    print("Prompt to LLM:")
-    print(prompt)
+    logger.debug("Prompt to LLM: %s", prompt)
 
     # 2. Define Headers
     headers = {
         "Content-Type": "application/json",
-        "Authorization": "Bearer local-anything"
+        "Authorization": f"Bearer {llm_api_key}"
     }
 
     # 3. Define Payload
@@ -111,21 +389,29 @@ def _llm_request(llm_url: str, llm_model: str, llm_api_key: str, prompt: str) ->
         ]
     }
 
-    # 4. Send Request
-    try:
-        # Using 'json=' automatically serializes the dictionary and sets content-type
-        response = requests.post(llm_url, headers=headers, json=payload)
-        
-        # Check for HTTP errors
-        response.raise_for_status()
-        
-        # Print the parsed JSON response
-        print(json.dumps(response.json(), indent=2))
-
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred: {e}")
+    # 4. Send Request, streamed if the server allows it
+    global _llm_streaming
+    streamed = _llm_streaming
+    if streamed:
+        content = _llm_stream_content(llm_url, headers, payload, opener)
+        if content is not None:
+            if not content:
+                raise RuntimeError("LLM response missing content")
+            return content
+
+    response = _SESSION.post(llm_url, headers=headers, data=_json_body(payload), timeout=LLM_TIMEOUT)
     response.raise_for_status()
-    payload = response.json()
+    content = _message_content(response.content)
+    if streamed:
+        # Only streaming was refused, not the prompt.
+        _llm_streaming = False
+    return content
+
+
+def _message_content(body: bytes) -> str:
+    payload = _json_loads(body)
+    logger.debug("LLM response: %s", payload)
+
     choices = payload.get("choices") or []
     if not choices:
         raise RuntimeError("LLM response missing choices")
@@ -135,14 +421,84 @@ def _llm_request(llm_url: str, llm_model: str, llm_api_key: str, prompt: str) ->
     return content.strip()
 
 
+def warm_up(settings) -> None:
+    """
+    Pay the one-off costs before the first utterance: open the keep-alive
+    connections to the LLM server and Home Assistant, and parse the registry
+    into the prompt cache.
+    """
+    parts = urlsplit(settings.llm_url)
+    try:
+        _SESSION.get(f"{parts.scheme}://{parts.netloc}/health", timeout=1)
+    except requests.exceptions.RequestException as e:
+        logger.warning("LLM warm-up failed: %s", e)
+    if settings.ha_token:
+        try:
+            hass_session().get(
+                f"{settings.ha_url}/api/", headers=auth_headers(settings.ha_token), timeout=1
+            )
+        except requests.exceptions.RequestException as e:
+            logger.warning("HA warm-up failed: %s", e)
+    try:
+        reg = current_registry(settings)
+        if len(_prompt_entities(reg)) <= PROMPT_MAX_ENTITIES:
+            _prompt_template(reg)
+    except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+        # Best effort: a broken registry is reported again when a command uses it.
+        logger.warning("Registry warm-up failed: %r", e)
+
+
 def llm_route(settings, user_text: str, reg: Dict[str, Any]) -> Dict[str, Any]:
     prompt = _build_prompt(user_text, reg)
 
-    t0 = time.time()
+    t0 = time.perf_counter()
     text = _llm_request(settings.llm_url, settings.llm_model, settings.llm_api_key, prompt)
-    print(text)
-    print(f"time to run LLM: {time.time() - t0} s")
-    return json.loads(text)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("LLM reply: %s", text)
+        logger.debug("time to run LLM: %.3fs", time.perf_counter() - t0)
+    return _json_loads(text)
+
+
+def llm_route_batch(settings, user_texts: List[str], reg: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One LLM round-trip for several commands; returns one result per text."""
+    prompt = _build_prompt_batch(user_texts, reg)
+
+    t0 = time.perf_counter()
+    text = _llm_request(
+        settings.llm_url, settings.llm_model, settings.llm_api_key, prompt, opener="["
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("LLM reply: %s", text)
+        logger.debug("time to run LLM (%d commands): %.3fs", len(user_texts), time.perf_counter() - t0)
+    results = _json_loads(text)
+    if not (
+        isinstance(results, list)
+        and len(results) == len(user_texts)
+        and all(isinstance(r, dict) for r in results)
+    ):
+        raise RuntimeError(f"LLM reply is not {len(user_texts)} result objects: {text[:200]}")
+    return results
+
+
+def _route_one(settings, user_text: str, reg: Dict[str, Any]) -> Dict[str, Any] | None:
+    # A bad reply for one command must not discard the others' results.
+    try:
+        result = llm_route(settings, user_text, reg)
+    except (RuntimeError, ValueError, requests.exceptions.RequestException) as e:
+        logger.warning("LLM error for %r: %s", user_text, e)
+        return None
+    if not isinstance(result, dict):
+        logger.warning("LLM error for %r: reply is not an object: %r", user_text, result)
+        return None
+    return result
+
+
+def llm_route_many(settings, user_texts: List[str], reg: Dict[str, Any]) -> List[Dict[str, Any] | None]:
+    """
+    One LLM request per text, at most LLM_MAX_CONCURRENCY in flight; results
+    keep input order, with None where routing failed.
+    """
+    return list(_LLM_POOL.map(lambda t: _route_one(settings, t, reg), user_texts))
 
 
 def _validate_llm_result(
@@ -157,59 +513,79 @@ def _validate_llm_result(
     if service not in ALLOWED_SERVICES:
         raise RuntimeError(f"Invalid service from LLM: {service}")
     if not entity_friendly_name:
-        set_volume(settings, "media_player.living_room", 0.1)
-        play_on_sonos(
+        play_sound_async(
             settings,
             "media_player.living_room",
             "http://192.168.1.203:8123/local/capture_failed.wav",
+            0.1,
         )
         raise RuntimeError("LLM did not return an entity_friendly_name")
 
-    valid_entities = {e.get("friendly_norm"): e.get("entity_id") for e in reg.get("entities", [])}
-    friendly_norm = norm(entity_friendly_name)
-    entity_id = valid_entities.get(friendly_norm)
+    entity_id = reg["_friendly_index"].get(norm(entity_friendly_name))
     if not entity_id:
         raise RuntimeError(f"Entity not found for friendly name: {entity_friendly_name}")
 
-    cleaned: Dict[str, Any] = {}
-    if "brightness_pct" in data:
-        try:
-            brightness = int(data["brightness_pct"])
-        except (TypeError, ValueError):
-            raise RuntimeError("brightness_pct must be an integer")
-        brightness = max(1, min(100, brightness))
-        cleaned["brightness_pct"] = brightness
-    if "color_temp_kelvin" in data:
-        try:
-            color_temp = int(data["color_temp_kelvin"])
-        except (TypeError, ValueError):
-            raise RuntimeError("color_temp_kelvin must be an integer")
-        color_temp = max(2300, min(4000, color_temp))
-        cleaned["color_temp_kelvin"] = color_temp
-    return service, entity_id, cleaned
+    return service, entity_id, _clean_data(data)
 
 
-def handle_text(settings, text: str) -> None:
-    reg = load_registry(str(settings.registry_path))
-    result = llm_route(settings, text, reg)
+def _clean_data(data: Dict[str, Any]) -> Dict[str, Any]:
+    cleaned: Dict[str, Any] = {}
+    for key, (lo, hi) in _PARAM_SPEC.items():
+        if key not in data:
+            continue
+        value = data[key]
+        if not isinstance(value, int):
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise RuntimeError(f"{key} must be an integer")
+        cleaned[key] = min(hi, max(lo, value))
+    return cleaned
+
+
+def _dispatch(settings, result: Dict[str, Any], reg: Dict[str, Any]) -> None:
     try:
         service, entity_id, data = _validate_llm_result(result, reg, settings)
     except RuntimeError as e:
         print(f"Validation error: {e}")
         return
-    domain = entity_id.split(".", 1)[0]
+    domain = entity_id.partition(".")[0]
     payload = {"entity_id": entity_id}
     payload.update(data)
     ha_call(settings, domain, service, payload)
     print(f"Executed: {domain}.{service} -> {entity_id} {data or ''}".strip())
 
 
+def handle_text(settings, text: str) -> None:
+    reg = current_registry(settings)
+    result = llm_route(settings, text, reg)
+    _dispatch(settings, result, reg)
+
+
+def handle_text_batch(settings, texts: List[str]) -> None:
+    """Route several queued commands through a single LLM call."""
+    if len(texts) == 1:
+        handle_text(settings, texts[0])
+        return
+    reg = current_registry(settings)
+    try:
+        results = llm_route_batch(settings, texts, reg)
+    except (RuntimeError, ValueError, requests.exceptions.RequestException) as e:
+        # Unusable batched reply: ask about each command separately, in parallel.
+        logger.debug("Batched LLM reply rejected (%s); routing %d commands individually", e, len(texts))
+        results = llm_route_many(settings, texts, reg)
+    for result in results:
+        if result is not None:
+            _dispatch(settings, result, reg)
+
+
 def main() -> int:
     if len(sys.argv) < 2:
         print("Usage: voice_route.py 'turn on kitchen light'", file=sys.stderr)
         return 2
 
-    settings = load_settings()
+    settings = load_settings()  # also reads LOG_LEVEL from ~/.ha_env
+    logging.basicConfig(level=log_level())
     text = " ".join(sys.argv[1:])
     handle_text(settings, text)
     return 0